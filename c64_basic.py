@@ -6,11 +6,18 @@ A Python implementation that mimics the classic C64 BASIC environment
 
 import re
 import math
+import functools
 import random
 import time
 import os
 import sys
-from typing import Dict, List, Any, Optional, Union
+from typing import Dict, List, Any, Callable, Optional, Union
+
+# Optional: numba compiles long numeric FOR loops to native code. It is slow to
+# import, so _import_numba() loads it the first time a loop qualifies; numba is
+# False once the import has failed (setting it to False turns compiling off)
+numba = None
+numpy = None
 
 # ANSI color codes for C64-style colors
 class C64Colors:
@@ -50,16 +57,493 @@ class C64Colors:
     CLEAR_LINE = '\033[K'
     CURSOR_HOME = '\033[H'
 
+# C64 color numbers (0-15) to ANSI foreground and background codes
+_FG_MAP = {
+    0: C64Colors.BLACK,
+    1: C64Colors.WHITE,
+    2: C64Colors.RED,
+    3: C64Colors.CYAN,
+    4: C64Colors.PURPLE,
+    5: C64Colors.GREEN,
+    6: C64Colors.BLUE,
+    7: C64Colors.YELLOW,
+    8: C64Colors.ORANGE,
+    9: C64Colors.BROWN,
+    10: C64Colors.LIGHT_RED,
+    11: C64Colors.DARK_GREY,
+    12: C64Colors.GREY,
+    13: C64Colors.LIGHT_GREEN,
+    14: C64Colors.LIGHT_BLUE,
+    15: C64Colors.LIGHT_GREY,
+}
+
+_BG_MAP = {
+    0: C64Colors.BG_BLACK,
+    1: C64Colors.BG_WHITE,
+    2: C64Colors.BG_RED,
+    3: C64Colors.BG_CYAN,
+    4: C64Colors.BG_PURPLE,
+    5: C64Colors.BG_GREEN,
+    6: C64Colors.BG_BLUE,
+    7: C64Colors.BG_YELLOW,
+    8: C64Colors.BG_YELLOW,
+    9: C64Colors.BG_YELLOW,
+    10: C64Colors.BG_RED,
+    11: C64Colors.BG_BLACK,
+    12: C64Colors.BG_WHITE,
+    13: C64Colors.BG_GREEN,
+    14: C64Colors.BG_LIGHT_BLUE,
+    15: C64Colors.BG_WHITE,
+}
+
+# Statement opcodes produced by C64Basic.compile_line
+OP_REM = 0
+OP_PRINT = 1
+OP_INPUT = 2
+OP_LET = 3
+OP_IF = 4
+OP_FOR = 5
+OP_NEXT = 6
+OP_GOTO = 7
+OP_GOSUB = 8
+OP_RETURN = 9
+OP_CLS = 10
+OP_LIST = 11
+OP_RUN = 12
+OP_NEW = 13
+OP_END = 14
+OP_WAIT = 15
+OP_SIMULATED = 16
+OP_LOAD = 17
+OP_SAVE = 18
+OP_COLOR = 19
+OP_SCREEN = 20
+OP_ERROR = 21
+OP_FOR_RANGE = 22  # FOR whose body is straight-line code, chosen when the program is linked
+
+# Keywords compiled even when the statement contains '=' (otherwise it is an assignment)
+_PRE_ASSIGNMENT_KEYWORDS = {'PRINT', 'INPUT', 'REM', 'IF', 'FOR'}
+
+# Statements that never transfer control, safe to run inside a FOR_RANGE body
+_STRAIGHT_LINE_OPS = {OP_REM, OP_PRINT, OP_LET}
+
+class Instr:
+    """A BASIC statement compiled once into an opcode and its pre-parsed arguments"""
+    __slots__ = ('op', 'args', 'target', 'body', 'source')
+    
+    def __init__(self, op: int, args: Any = None):
+        self.op = op
+        self.args = args
+        # Program counter of a GOTO/GOSUB destination (or the statement after a
+        # FOR_RANGE loop's NEXT), resolved when the program is linked
+        self.target: Optional[int] = None
+        # Loop body of a FOR_RANGE statement
+        self.body: Optional[List['Instr']] = None
+        # Source text of a program line, for LIST and SAVE
+        self.source = ""
+    
+    def is_straight_line(self) -> bool:
+        """Whether executing this statement can never change the program counter"""
+        if self.op == OP_IF:
+            return self.args[1].is_straight_line()
+        return self.op in _STRAIGHT_LINE_OPS
+
+# Expression tokens: string literal, number, identifier (optionally $-suffixed), operator
+_TOKEN_RE = re.compile(r'\s*(?:("[^"]*")|((?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)|([A-Za-z][A-Za-z0-9]*\$?)|(<>|<=|>=|[-+*/^()<>=,]))')
+
+def _number(value):
+    """Collapse integral float results to int, as C64 BASIC prints them"""
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+def _add(a, b):
+    """Addition, or concatenation when either operand is a string"""
+    if isinstance(a, str) or isinstance(b, str):
+        return str(a) + str(b)
+    return _number(a + b)
+
+def _power(a, b):
+    """Exponentiation that refuses complex results"""
+    result = a ** b
+    if isinstance(result, complex):
+        raise ValueError("complex result")
+    return _number(result)
+
+_BINARY_OPS = {
+    '+': _add,
+    '-': lambda a, b: _number(a - b),
+    '*': lambda a, b: _number(a * b),
+    '/': lambda a, b: _number(a / b),
+    '^': _power,
+    # Comparisons yield -1 for true and 0 for false, as on the C64
+    '=': lambda a, b: -1 if a == b else 0,
+    '<>': lambda a, b: -1 if a != b else 0,
+    '<': lambda a, b: -1 if a < b else 0,
+    '>': lambda a, b: -1 if a > b else 0,
+    '<=': lambda a, b: -1 if a <= b else 0,
+    '>=': lambda a, b: -1 if a >= b else 0,
+}
+
+_COMPARISON_OPS = ('=', '<>', '<', '>', '<=', '>=')
+
+class _ExprParser:
+    """Recursive-descent parser that emits an expression as postfix opcodes"""
+    
+    def __init__(self, src: str):
+        self.tokens = []
+        pos = 0
+        src = src.rstrip()
+        while pos < len(src):
+            match = _TOKEN_RE.match(src, pos)
+            if not match:
+                raise ValueError(f"bad character in expression: {src[pos:]!r}")
+            string, number, name, op = match.groups()
+            if string is not None:
+                self.tokens.append(('const', string[1:-1]))
+            elif number is not None:
+                if number.isdigit():
+                    self.tokens.append(('const', int(number)))
+                else:
+                    self.tokens.append(('const', _number(float(number))))
+            elif name is not None:
+                self.tokens.append(('name', sys.intern(name)))
+            else:
+                self.tokens.append(('op', op))
+            pos = match.end()
+        self.pos = 0
+        self.ops: List[tuple] = []
+    
+    def peek(self) -> Optional[str]:
+        """Return the operator at the current position, if any"""
+        if self.pos < len(self.tokens) and self.tokens[self.pos][0] == 'op':
+            return self.tokens[self.pos][1]
+        return None
+    
+    def expect(self, op: str):
+        if self.peek() != op:
+            raise ValueError(f"expected {op!r}")
+        self.pos += 1
+    
+    def parse(self) -> tuple:
+        self.expression()
+        if self.pos != len(self.tokens):
+            raise ValueError("unexpected trailing tokens")
+        return tuple(self.ops)
+    
+    def expression(self):
+        # comparison: additive (('='|'<>'|'<'|'>'|'<='|'>=') additive)*
+        self.additive()
+        while self.peek() in _COMPARISON_OPS:
+            op = self.tokens[self.pos][1]
+            self.pos += 1
+            self.additive()
+            self.ops.append(('bin', op))
+    
+    def additive(self):
+        # additive: term (('+'|'-') term)*
+        self.term()
+        while self.peek() in ('+', '-'):
+            op = self.tokens[self.pos][1]
+            self.pos += 1
+            self.term()
+            self.ops.append(('bin', op))
+    
+    def term(self):
+        # term: unary (('*'|'/') unary)*
+        self.unary()
+        while self.peek() in ('*', '/'):
+            op = self.tokens[self.pos][1]
+            self.pos += 1
+            self.unary()
+            self.ops.append(('bin', op))
+    
+    def unary(self):
+        # unary: ('-'|'+') unary | power
+        op = self.peek()
+        if op in ('-', '+'):
+            self.pos += 1
+            self.unary()
+            if op == '-':
+                self.ops.append(('neg',))
+        else:
+            self.power()
+    
+    def power(self):
+        # power: primary ('^' ('-'|'+')* primary)*, applied left to right
+        self.primary()
+        while self.peek() == '^':
+            self.pos += 1
+            negate = False
+            while self.peek() in ('-', '+'):
+                negate ^= self.tokens[self.pos][1] == '-'
+                self.pos += 1
+            self.primary()
+            if negate:
+                self.ops.append(('neg',))
+            self.ops.append(('bin', '^'))
+    
+    def primary(self):
+        if self.pos >= len(self.tokens):
+            raise ValueError("unexpected end of expression")
+        kind, value = self.tokens[self.pos]
+        self.pos += 1
+        if kind == 'const':
+            self.ops.append(('const', value))
+        elif kind == 'name':
+            if self.peek() == '(':
+                # Function call
+                self.pos += 1
+                argc = 0
+                if self.peek() != ')':
+                    self.expression()
+                    argc = 1
+                    while self.peek() == ',':
+                        self.pos += 1
+                        self.expression()
+                        argc += 1
+                self.expect(')')
+                self.ops.append(('call', sys.intern(value.upper()), argc))
+            else:
+                self.ops.append(('var', value))
+        elif value == '(':
+            self.expression()
+            self.expect(')')
+        else:
+            raise ValueError(f"unexpected {value!r}")
+
+# PRINT argument pieces: a string literal (possibly unterminated), a paren or separator, or other text
+_PRINT_TOK = re.compile(r'"[^"]*(?:"|$)|[(),;]|[^"(),;]+')
+
+# FOR_RANGE loops with fewer iterations run interpreted; importing numba and
+# compiling takes about 0.4s, which a one-statement body at about 1.5us per
+# iteration only earns back from roughly 290000 iterations on
+_JIT_MIN_TRIPS = 300000
+
+# Arithmetic a compiled loop body may use, spelled as Python operators
+_JIT_BINARY_OPS = {'+': '+', '-': '-', '*': '*', '/': '/', '^': '**'}
+
+# Integers at or above this size are not exact in a float64 slot
+_JIT_EXACT_INT = 2 ** 53
+
+def _import_numba() -> bool:
+    """Import numba and numpy on first use; whether loops can be compiled"""
+    global numba, numpy
+    if numba is None:
+        try:
+            import numba
+            import numpy
+        except ImportError:
+            numba = False
+    return numba is not False
+
+# Opcodes of a malformed expression, which evaluates to 0
+MALFORMED_EXPR = (('const', 0),)
+
+@functools.lru_cache(maxsize=4096)
+def parse_expr(src: str) -> tuple:
+    """Parse an expression into postfix opcodes, cached by source text"""
+    try:
+        return _ExprParser(src).parse()
+    except ValueError:
+        return MALFORMED_EXPR
+
+class ForFrame:
+    """Runtime state of an active FOR loop"""
+    __slots__ = ('current', 'end', 'step', 'return_pc')
+    
+    def __init__(self, start: Union[int, float], end: Union[int, float], step: Union[int, float], return_pc: int):
+        self.current = start
+        self.end = end
+        self.step = step
+        self.return_pc = return_pc
+
+def _default_value(name: str) -> Union[int, float, str]:
+    """Value of a variable that has never been assigned"""
+    return "" if name.endswith('$') else 0
+
+class VariableView:
+    """Dictionary-style access to the interpreter's variable slots by name"""
+    
+    def __init__(self, interpreter: 'C64Basic'):
+        self._interpreter = interpreter
+    
+    def __getitem__(self, name: str) -> Union[int, float, str]:
+        return self._interpreter._slots[self._interpreter._sym[name]]
+    
+    def __setitem__(self, name: str, value: Union[int, float, str]):
+        interpreter = self._interpreter
+        interpreter._slots[interpreter.intern(name)] = value
+    
+    def __contains__(self, name: str) -> bool:
+        return name in self._interpreter._sym
+    
+    def get(self, name: str, default: Any = None) -> Any:
+        slot = self._interpreter._sym.get(name)
+        return default if slot is None else self._interpreter._slots[slot]
+    
+    def items(self) -> List[tuple]:
+        slots = self._interpreter._slots
+        return [(name, slots[slot]) for name, slot in self._interpreter._sym.items()]
+    
+    def clear(self):
+        """Reset every variable to its default value (slots stay allocated)"""
+        interpreter = self._interpreter
+        for name, slot in interpreter._sym.items():
+            interpreter._slots[slot] = _default_value(name)
+
+# Pending output fragments that force a write even before the next flush point
+_OUT_BUF_LIMIT = 256
+
+def _jit_expr_source(ops: tuple, target: str) -> Optional[List[str]]:
+    """Python statements storing numeric expression opcodes in target, or None when they need the interpreter"""
+    stack = []
+    statements = []
+    for op in ops:
+        kind = op[0]
+        if kind == 'const':
+            value = op[1]
+            # Literals are ints or fractions, but a folded SQR(16) is the float 4.0,
+            # which would come back from a compiled run as an int
+            if not _jit_exact(value):
+                return None
+            stack.append(repr(float(value)))
+        elif kind == 'var':
+            stack.append(f"slots[{op[1]}]")
+        elif kind == 'bin' and op[1] in _JIT_BINARY_OPS:
+            right = stack.pop()
+            left = stack.pop()
+            # Past 2**53 float64 and the interpreter's exact integers part ways (NaN and
+            # infinity fail the test too), so the compiled loop gives up on the spot
+            temp = f"t{len(statements)}"
+            statements.append(f"{temp} = {left} {_JIT_BINARY_OPS[op[1]]} {right}")
+            statements.append(f"if not abs({temp}) < {float(_JIT_EXACT_INT)!r}: return False")
+            stack.append(temp)
+        elif kind == 'neg':
+            stack.append(f"(-{stack.pop()})")
+        else:
+            return None
+    statements.append(f"{target} = {stack[-1]}")
+    return statements
+
+def _jit_exact(value) -> bool:
+    """Whether a slot value survives a round trip through float64 unchanged"""
+    if type(value) is int:
+        return abs(value) < _JIT_EXACT_INT
+    return type(value) is float and math.isfinite(value) and not value.is_integer()
+
+# Functions whose result can change between calls with the same variables
+_VOLATILE_FUNCTIONS = {'RND'}
+
+@functools.lru_cache(maxsize=4096)
+def is_volatile(src: str) -> bool:
+    """Whether an expression must be re-evaluated even if no variable changed"""
+    return any(op[0] == 'call' and op[1] in _VOLATILE_FUNCTIONS for op in parse_expr(src))
+
 class C64Basic:
     def __init__(self):
-        self.variables: Dict[str, Union[int, float, str]] = {}
-        self.lines: Dict[int, str] = {}
-        self.current_line = 0
+        # Variable values live in a flat slot list indexed through a symbol table;
+        # compiled code refers to slots directly, self.variables is a by-name view
+        self._sym: Dict[str, int] = {}
+        self._slots: List[Union[int, float, str]] = []
+        self.variables = VariableView(self)
+        
+        # Expression opcodes with variables resolved to slots, keyed by source text
+        self._expr_code: Dict[str, tuple] = {}
+        
+        # Numba-compiled FOR_RANGE bodies (None when a loop can't be compiled), per linked FOR
+        self._jit_loops: Dict[Instr, Optional[tuple]] = {}
+        
+        # Program lines, compiled as they are entered or loaded, keyed by line number
+        self.lines: Dict[int, Instr] = {}
+        # Index into the linked program (self._code) of the next statement to run
         self.program_counter = 0
         self.running = False
-        self.for_loops: Dict[str, Dict] = {}
+        # Active FOR loop of each variable, indexed by the variable's slot
+        self._for_frames: List[Optional[ForFrame]] = []
         self.gosub_stack: List[int] = []
         self.colors_enabled = self.check_color_support()
+        # Output waiting to be written to stdout
+        self._out_buf: List[str] = []
+        # Escape codes wrapped around PRINT output, built once
+        self._print_prefix = C64Colors.WHITE + C64Colors.BG_BLUE
+        self._print_suffix = C64Colors.RESET
+        # Output methods picked once, so plain (non-terminal) output skips the escape codes entirely
+        if self.colors_enabled:
+            self.color_print = self._color_print_ansi
+            self.print_text = self._print_text_ansi
+            self.set_color = self._set_color_ansi
+        else:
+            self.color_print = self._color_print_plain
+            self.print_text = self._emit
+            self.set_color = self._set_color_plain
+        
+        # Sorted line numbers, rebuilt only after the program has changed
+        self._sorted_lines: List[int] = []
+        self._lines_dirty = True
+        # Whether self._code reflects the current program
+        self._linked = False
+        
+        # Linked program: line numbers in order, their instructions and line -> index map
+        self._order: List[int] = []
+        self._code: List[Instr] = []
+        self._line_index: Dict[int, int] = {}
+        
+        # Opcode -> handler table used to execute compiled statements
+        self._dispatch = {
+            OP_REM: self._exec_rem,
+            OP_PRINT: self._exec_print,
+            OP_INPUT: self._exec_input,
+            OP_LET: self._exec_let,
+            OP_IF: self._exec_if,
+            OP_FOR: self._exec_for,
+            OP_NEXT: self._exec_next,
+            OP_GOTO: self._exec_goto,
+            OP_GOSUB: self._exec_gosub,
+            OP_RETURN: self._exec_return,
+            OP_CLS: self._exec_cls,
+            OP_LIST: self._exec_list,
+            OP_RUN: self._exec_run,
+            OP_NEW: self._exec_new,
+            OP_END: self._exec_end,
+            OP_WAIT: self._exec_wait,
+            OP_SIMULATED: self._exec_simulated,
+            OP_LOAD: self._exec_load,
+            OP_SAVE: self._exec_save,
+            OP_COLOR: self._exec_color,
+            OP_SCREEN: self._exec_screen,
+            OP_ERROR: self._exec_error,
+            OP_FOR_RANGE: self._exec_for_range,
+        }
+        
+        # Keyword -> compiler of the text following it
+        self._stmt_compilers = {
+            'PRINT': self.compile_print,
+            'INPUT': self.compile_input,
+            'REM': lambda args: Instr(OP_REM),
+            'IF': self.compile_if_then,
+            'FOR': self.compile_for,
+            'NEXT': self.compile_next,
+            'GOTO': lambda args: Instr(OP_GOTO, args),
+            'GOSUB': lambda args: Instr(OP_GOSUB, args),
+            # These take no arguments and must match the whole statement
+            'RETURN': lambda args: Instr(OP_ERROR if args else OP_RETURN),
+            'CLS': lambda args: Instr(OP_ERROR if args else OP_CLS),
+            'RUN': lambda args: Instr(OP_ERROR if args else OP_RUN),
+            'NEW': lambda args: Instr(OP_ERROR if args else OP_NEW),
+            'END': lambda args: Instr(OP_ERROR if args else OP_END),
+            'LIST': lambda args: Instr(OP_LIST),
+            'WAIT': lambda args: Instr(OP_WAIT, args),
+            'POKE': lambda args: Instr(OP_SIMULATED, "POKE: Memory location simulated\n"),
+            'PEEK': lambda args: Instr(OP_SIMULATED, "PEEK: Memory location simulated\n"),
+            'SYS': lambda args: Instr(OP_SIMULATED, "SYS: Machine language call simulated\n"),
+            'LOAD': lambda args: Instr(OP_LOAD, args),
+            'SAVE': lambda args: Instr(OP_SAVE, args),
+            'COLOR': lambda args: Instr(OP_COLOR, args),
+            'SCREEN': lambda args: Instr(OP_SCREEN, args),
+        }
+        # Statement keyword at the start of a command; C64 BASIC needs no space after it
+        self._keyword_re = re.compile('|'.join(sorted(self._stmt_compilers, key=len, reverse=True)))
         
         # Built-in functions
         self.functions = {
@@ -79,6 +563,12 @@ class C64Basic:
             'VAL': float,
         }
         
+        self.reset_variables()
+        
+    def reset_variables(self):
+        """Reset every variable to its default and restore the system variables"""
+        self.variables.clear()
+        
         # System variables
         self.variables['TI'] = 0  # Timer
         self.variables['TI$'] = "000000"  # Timer as string
@@ -86,7 +576,17 @@ class C64Basic:
         # Color variables (C64-style)
         self.variables['CO'] = 0  # Color (foreground)
         self.variables['BG'] = 6  # Background color (blue)
-        
+    
+    def intern(self, name: str) -> int:
+        """Return the slot of a variable, allocating it on first use"""
+        slot = self._sym.get(name)
+        if slot is None:
+            # Interned keys let later lookups with interned names hit the identity fast path
+            slot = self._sym[sys.intern(name)] = len(self._slots)
+            self._slots.append(_default_value(name))
+            self._for_frames.append(None)
+        return slot
+    
     def check_color_support(self):
         """Check if terminal supports colors"""
         return (
@@ -96,74 +596,49 @@ class C64Basic:
             os.environ['TERM'] != 'dumb'
         )
     
-    def color_print(self, text: str, fg_color: str = C64Colors.WHITE, bg_color: str = C64Colors.BG_BLUE, bold: bool = False):
+    def _color_print_ansi(self, text: str, fg_color: str = C64Colors.WHITE, bg_color: str = C64Colors.BG_BLUE, bold: bool = False):
         """Print text with C64-style colors"""
-        if self.colors_enabled:
-            color_code = ""
-            if bold:
-                color_code += C64Colors.BOLD
-            color_code += fg_color + bg_color + text + C64Colors.RESET
-            print(color_code, end="")
+        if bold:
+            self._emit(C64Colors.BOLD + fg_color + bg_color + text + C64Colors.RESET)
         else:
-            print(text, end="")
+            self._emit(fg_color + bg_color + text + C64Colors.RESET)
+    
+    def _color_print_plain(self, text: str, fg_color: str = C64Colors.WHITE, bg_color: str = C64Colors.BG_BLUE, bold: bool = False):
+        """Print text without colors"""
+        self._emit(text)
+    
+    def _print_text_ansi(self, text: str):
+        """Print text in the default PRINT colors"""
+        self._emit(self._print_prefix + text + self._print_suffix)
+    
+    def _emit(self, text: str):
+        """Queue text for output"""
+        self._out_buf.append(text)
+        if len(self._out_buf) >= _OUT_BUF_LIMIT:
+            self._flush()
+    
+    def _flush(self):
+        """Write all queued output to stdout"""
+        if self._out_buf:
+            sys.stdout.write(''.join(self._out_buf))
+            self._out_buf.clear()
+        sys.stdout.flush()
+    
+    def _set_color_plain(self, fg: int = 1, bg: int = 6):
+        """Ignore color changes when the terminal has no colors"""
     
-    def set_color(self, fg: int = 1, bg: int = 6):
+    def _set_color_ansi(self, fg: int = 1, bg: int = 6):
         """Set C64-style colors (1=white, 6=blue, etc.)"""
-        if not self.colors_enabled:
-            return
-            
-        color_map = {
-            0: (C64Colors.BLACK, C64Colors.BG_BLACK),
-            1: (C64Colors.WHITE, C64Colors.BG_BLACK),
-            2: (C64Colors.RED, C64Colors.BG_BLACK),
-            3: (C64Colors.CYAN, C64Colors.BG_BLACK),
-            4: (C64Colors.PURPLE, C64Colors.BG_BLACK),
-            5: (C64Colors.GREEN, C64Colors.BG_BLACK),
-            6: (C64Colors.BLUE, C64Colors.BG_BLACK),
-            7: (C64Colors.YELLOW, C64Colors.BG_BLACK),
-            8: (C64Colors.ORANGE, C64Colors.BG_BLACK),
-            9: (C64Colors.BROWN, C64Colors.BG_BLACK),
-            10: (C64Colors.LIGHT_RED, C64Colors.BG_BLACK),
-            11: (C64Colors.DARK_GREY, C64Colors.BG_BLACK),
-            12: (C64Colors.GREY, C64Colors.BG_BLACK),
-            13: (C64Colors.LIGHT_GREEN, C64Colors.BG_BLACK),
-            14: (C64Colors.LIGHT_BLUE, C64Colors.BG_BLACK),
-            15: (C64Colors.LIGHT_GREY, C64Colors.BG_BLACK),
-        }
-        
-        bg_map = {
-            0: C64Colors.BG_BLACK,
-            1: C64Colors.BG_WHITE,
-            2: C64Colors.BG_RED,
-            3: C64Colors.BG_CYAN,
-            4: C64Colors.BG_PURPLE,
-            5: C64Colors.BG_GREEN,
-            6: C64Colors.BG_BLUE,
-            7: C64Colors.BG_YELLOW,
-            8: C64Colors.BG_YELLOW,
-            9: C64Colors.BG_YELLOW,
-            10: C64Colors.BG_RED,
-            11: C64Colors.BG_BLACK,
-            12: C64Colors.BG_WHITE,
-            13: C64Colors.BG_GREEN,
-            14: C64Colors.BG_LIGHT_BLUE,
-            15: C64Colors.BG_WHITE,
-        }
-        
-        fg_color, _ = color_map.get(fg, (C64Colors.WHITE, C64Colors.BG_BLACK))
-        bg_color = bg_map.get(bg, C64Colors.BG_BLUE)
-        
         # Set terminal colors
-        sys.stdout.write(fg_color + bg_color)
-        sys.stdout.flush()
+        self._emit(_FG_MAP.get(fg, C64Colors.WHITE) + _BG_MAP.get(bg, C64Colors.BG_BLUE))
         
     def print_banner(self):
         """Display the classic C64 startup banner with colors"""
         if self.colors_enabled:
             # Clear screen and set C64 colors
-            print(C64Colors.CLEAR_SCREEN, end="")
+            self._emit(C64Colors.CLEAR_SCREEN)
             self.set_color(1, 6)  # White text on blue background
-            print(C64Colors.CURSOR_HOME, end="")
+            self._emit(C64Colors.CURSOR_HOME)
         
         self.color_print("    **** COMMODORE 64 BASIC V2 ****\n", C64Colors.WHITE, C64Colors.BG_BLUE, True)
         self.color_print(" 64K RAM SYSTEM  38911 BASIC BYTES FREE\n", C64Colors.WHITE, C64Colors.BG_BLUE)
@@ -173,7 +648,7 @@ class C64Basic:
         
         if self.colors_enabled:
             # Reset colors for input
-            print(C64Colors.RESET, end="")
+            self._emit(C64Colors.RESET)
     
     def print_ready(self):
         """Print READY prompt with C64 colors"""
@@ -191,11 +666,11 @@ class C64Basic:
     def clear_screen(self):
         """Clear screen with C64 colors"""
         if self.colors_enabled:
-            print(C64Colors.CLEAR_SCREEN, end="")
+            self._emit(C64Colors.CLEAR_SCREEN)
             self.set_color(1, 6)  # White text on blue background
-            print(C64Colors.CURSOR_HOME, end="")
+            self._emit(C64Colors.CURSOR_HOME)
         else:
-            print("\n" * 50)
+            self._emit("\n" * 51)
     
     def handle_color(self, args: str):
         """Handle COLOR command (C64-style)"""
@@ -234,14 +709,15 @@ class C64Basic:
                 with open(filename, 'r') as f:
                     # Clear current program
                     self.lines.clear()
+                    self.lines_changed()
                     
-                    # Load program lines
+                    # Load and compile program lines
                     for line in f:
                         line = line.strip()
                         if line:
                             line_num, command = self.parse_line(line)
                             if line_num is not None and command:
-                                self.lines[line_num] = command
+                                self.store_line(line_num, command)
                     
                     self.color_print(f"LOADING \"{filename}\"\n", C64Colors.WHITE, C64Colors.BG_BLUE)
                     self.color_print("READY.\n", C64Colors.WHITE, C64Colors.BG_BLUE, True)
@@ -270,8 +746,8 @@ class C64Basic:
             try:
                 with open(filename, 'w') as f:
                     # Save program lines in order
-                    for line_num in sorted(self.lines.keys()):
-                        f.write(f"{line_num} {self.lines[line_num]}\n")
+                    for line_num in self.sorted_lines():
+                        f.write(f"{line_num} {self.lines[line_num].source}\n")
                     
                     self.color_print(f"SAVING \"{filename}\"\n", C64Colors.WHITE, C64Colors.BG_BLUE)
                     self.color_print("READY.\n", C64Colors.WHITE, C64Colors.BG_BLUE, True)
@@ -284,92 +760,85 @@ class C64Basic:
     
     def evaluate_expression(self, expr: str) -> Union[int, float, str]:
         """Evaluate a mathematical or string expression"""
-        expr = expr.strip()
-        
-        # Handle string literals
-        if expr.startswith('"') and expr.endswith('"'):
-            return expr[1:-1]
-        
-        # Handle variables
-        if expr.isalpha() or (expr[0].isalpha() and all(c.isalnum() or c == '$' for c in expr[1:])):
-            if expr in self.variables:
-                return self.variables[expr]
-            else:
-                # Return 0 for numeric variables, "" for string variables
-                return 0 if not expr.endswith('$') else ""
-        
-        # Handle function calls
-        func_match = re.match(r'(\w+)\s*\((.*)\)', expr)
-        if func_match:
-            func_name = func_match.group(1).upper()
-            args_str = func_match.group(2)
-            
-            if func_name in self.functions:
-                # Parse arguments
-                args = []
-                paren_count = 0
-                current_arg = ""
-                
-                for char in args_str:
-                    if char == '(':
-                        paren_count += 1
-                    elif char == ')':
-                        paren_count -= 1
-                    elif char == ',' and paren_count == 0:
-                        args.append(current_arg.strip())
-                        current_arg = ""
-                        continue
-                    current_arg += char
-                
-                if current_arg:
-                    args.append(current_arg.strip())
-                
-                # Evaluate arguments
-                evaluated_args = []
-                for arg in args:
-                    if arg:
-                        evaluated_args.append(self.evaluate_expression(arg))
-                
-                # Call function
-                if func_name == 'RND':
-                    return self.functions[func_name]()
-                elif func_name in ['CHR$', 'STR$']:
-                    return self.functions[func_name](evaluated_args[0])
-                elif func_name == 'ASC':
-                    return self.functions[func_name](evaluated_args[0])
-                elif func_name == 'LEN':
-                    return self.functions[func_name](str(evaluated_args[0]))
-                else:
-                    return self.functions[func_name](*evaluated_args)
-        
-        # Handle basic arithmetic
         try:
-            # Replace variables with their values
-            for var_name, var_value in self.variables.items():
-                if isinstance(var_value, str):
-                    expr = expr.replace(var_name, f'"{var_value}"')
-                else:
-                    expr = expr.replace(var_name, str(var_value))
-            
-            # Handle string concatenation
-            if '+' in expr and '"' in expr:
-                parts = expr.split('+')
-                result = ""
-                for part in parts:
-                    part = part.strip()
-                    if part.startswith('"') and part.endswith('"'):
-                        result += part[1:-1]
-                    else:
-                        result += str(self.evaluate_expression(part))
-                return result
-            
-            # Evaluate numeric expression
-            result = eval(expr)
-            return int(result) if result == int(result) else result
-            
+            return self._eval_ops(self.compile_expr(expr.strip()))
         except:
             return 0
     
+    def compile_expr(self, src: str) -> tuple:
+        """Compile an expression into opcodes with variables resolved to slots"""
+        ops = self._expr_code.get(src)
+        if ops is None:
+            ops = tuple(self._bind_op(op) for op in parse_expr(src))
+            # An expression without variables or volatile calls always has the same value;
+            # one that fails keeps its opcodes so the error surfaces when it runs
+            if len(ops) > 1 and not is_volatile(src) and all(op[0] != 'var' for op in ops):
+                try:
+                    ops = (('const', self._eval_ops(ops)),)
+                except Exception:
+                    pass
+            self._expr_code[src] = ops
+        return ops
+    
+    def _bind_op(self, op: tuple) -> tuple:
+        """Attach the slot or callable an opcode needs at run time"""
+        kind = op[0]
+        if kind == 'var':
+            return ('var', self.intern(op[1]))
+        if kind == 'bin':
+            return op + (_BINARY_OPS[op[1]],)
+        if kind == 'call':
+            if op[1] in self.functions:
+                return op + (self.bind_function(op[1]),)
+            # Unknown functions fail when evaluated, like any other bad expression
+            return op + (functools.partial(self.call_function, op[1]),)
+        return op
+    
+    def _eval_ops(self, ops: tuple) -> Union[int, float, str]:
+        """Run compiled expression opcodes on a value stack"""
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        slots = self._slots
+        
+        for op in ops:
+            kind = op[0]
+            if kind == 'const':
+                push(op[1])
+            elif kind == 'var':
+                push(slots[op[1]])
+            elif kind == 'bin':
+                right = pop()
+                push(op[2](pop(), right))
+            elif kind == 'neg':
+                push(-pop())
+            else:
+                # Function call
+                argc = op[2]
+                args = stack[len(stack) - argc:]
+                del stack[len(stack) - argc:]
+                push(op[3](args))
+        
+        return stack[-1]
+    
+    def call_function(self, func_name: str, args: list) -> Union[int, float, str]:
+        """Call a built-in function with evaluated arguments"""
+        return self.bind_function(func_name)(args)
+    
+    def bind_function(self, func_name: str) -> Callable[[list], Union[int, float, str]]:
+        """Return a callable that applies a built-in function to an argument list"""
+        func = self.functions[func_name]
+        if func_name == 'RND':
+            return lambda args: func()
+        elif func_name in ['CHR$', 'STR$']:
+            return lambda args: func(args[0])
+        elif func_name == 'ASC':
+            return lambda args: func(args[0])
+        elif func_name == 'LEN':
+            return lambda args: func(str(args[0]))
+        else:
+            return lambda args: func(*args)
+    
     def parse_line(self, line: str) -> tuple:
         """Parse a BASIC line into line number and command"""
         line = line.strip()
@@ -385,202 +854,168 @@ class C64Basic:
         else:
             return None, line
     
-    def execute_command(self, command: str):
-        """Execute a BASIC command"""
+    def compile_line(self, command: str) -> Instr:
+        """Compile a BASIC command into an opcode and its pre-parsed arguments"""
         original_command = command.strip()
         command = original_command.upper()
         
         if not command:
-            return
-        
-        # PRINT command
-        if command.startswith('PRINT'):
-            self.handle_print(original_command[5:].strip())
+            return Instr(OP_REM)
         
-        # INPUT command
-        elif command.startswith('INPUT'):
-            self.handle_input(original_command[5:].strip())
+        match = self._keyword_re.match(command)
+        if match and (match.group() in _PRE_ASSIGNMENT_KEYWORDS or '=' not in command):
+            keyword = sys.intern(match.group())
+            return self._stmt_compilers[keyword](original_command[len(keyword):].strip())
         
         # LET command (variable assignment)
-        elif '=' in command:
-            self.handle_assignment(original_command)
-        
-        # IF-THEN command
-        elif command.startswith('IF'):
-            self.handle_if_then(original_command)
-        
-        # FOR command
-        elif command.startswith('FOR'):
-            self.handle_for(original_command)
-        
-        # NEXT command
-        elif command.startswith('NEXT'):
-            self.handle_next(original_command[4:].strip())
-        
-        # GOTO command
-        elif command.startswith('GOTO'):
-            target = int(self.evaluate_expression(original_command[4:].strip()))
-            self.program_counter = target
-            return
-        
-        # GOSUB command
-        elif command.startswith('GOSUB'):
-            target = int(self.evaluate_expression(original_command[5:].strip()))
-            self.gosub_stack.append(self.program_counter)
-            self.program_counter = target
-            return
-        
-        # RETURN command
-        elif command == 'RETURN':
-            if self.gosub_stack:
-                self.program_counter = self.gosub_stack.pop()
-            return
-        
-        # REM command (comment)
-        elif command.startswith('REM'):
-            return
+        if '=' in command:
+            return self.compile_assignment(original_command)
         
-        # CLS command (clear screen)
-        elif command == 'CLS':
-            self.clear_screen()
+        return Instr(OP_ERROR)
+    
+    def compile_print(self, args: str) -> Instr:
+        """Compile PRINT arguments into expression and separator parts"""
+        # Check if the PRINT statement ends with a semicolon
+        ends_with_semicolon = args.endswith(';')
         
-        # LIST command
-        elif command.startswith('LIST'):
-            self.list_program()
+        # Handle multiple expressions separated by semicolons or commas
+        parts = []
+        current_part = ""
+        paren_count = 0
         
-        # RUN command
-        elif command == 'RUN':
-            self.run_program()
+        for token in _PRINT_TOK.findall(args):
+            if token == '(':
+                paren_count += 1
+            elif token == ')':
+                paren_count -= 1
+            elif token in (';', ',') and paren_count == 0:
+                if current_part.strip():
+                    parts.append(('expr', self.compile_expr(current_part.strip())))
+                parts.append(('sep', token))
+                current_part = ""
+                continue
+            current_part += token
         
-        # NEW command
-        elif command == 'NEW':
-            self.lines.clear()
-            self.variables.clear()
-            self.program_counter = 0
-            self.print_ready()
+        if current_part.strip():
+            parts.append(('expr', self.compile_expr(current_part.strip())))
         
-        # END command
-        elif command == 'END':
-            self.running = False
+        return Instr(OP_PRINT, (parts, ends_with_semicolon))
+    
+    def compile_input(self, args: str) -> Instr:
+        """Compile INPUT prompt and variable list"""
+        prompt = ""
+        if args.startswith('"'):
+            end_quote = args.find('"', 1)
+            if end_quote != -1:
+                prompt = args[1:end_quote]
+                # Drop the separator between the prompt and the variables
+                args = args[end_quote + 1:].strip().lstrip(',;').strip()
         
-        # WAIT command (simple delay)
-        elif command.startswith('WAIT'):
-            try:
-                delay = float(self.evaluate_expression(original_command[4:].strip()))
-                time.sleep(delay)
-            except:
-                pass
+        # Parse variable names
+        var_names = [sys.intern(name.strip()) for name in args.split(',')]
+        return Instr(OP_INPUT, (prompt, var_names))
+    
+    def compile_assignment(self, command: str) -> Instr:
+        """Compile variable assignment (LET command)"""
+        if command.upper().startswith('LET '):
+            command = command[4:]
         
-        # POKE command (simulated)
-        elif command.startswith('POKE'):
-            self.color_print("POKE: Memory location simulated\n", C64Colors.RED, C64Colors.BG_BLUE, True)
+        var_part, expr_part = command.split('=', 1)
+        return Instr(OP_LET, (self.intern(var_part.strip()), expr_part.strip()))
+    
+    def compile_if_then(self, if_part: str) -> Instr:
+        """Compile IF-THEN condition and action"""
+        # Find THEN
+        then_index = if_part.upper().find('THEN')
+        if then_index == -1:
+            return Instr(OP_ERROR, "SYNTAX ERROR")
         
-        # PEEK command (simulated)
-        elif command.startswith('PEEK'):
-            self.color_print("PEEK: Memory location simulated\n", C64Colors.RED, C64Colors.BG_BLUE, True)
+        condition = if_part[:then_index].strip()
+        if parse_expr(condition) is MALFORMED_EXPR:
+            return Instr(OP_ERROR, "SYNTAX ERROR")
         
-        # SYS command (simulated)
-        elif command.startswith('SYS'):
-            self.color_print("SYS: Machine language call simulated\n", C64Colors.RED, C64Colors.BG_BLUE, True)
+        action = self.compile_line(if_part[then_index + 4:])
+        return Instr(OP_IF, (self.compile_expr(condition), action))
+    
+    def compile_for(self, for_part: str) -> Instr:
+        """Compile FOR loop header"""
+        # FOR I=1 TO 10 STEP 1
         
-        # LOAD command
-        elif command.startswith('LOAD'):
-            self.handle_load(original_command[4:].strip())
+        # Parse variable assignment
+        if '=' not in for_part:
+            return Instr(OP_ERROR, "SYNTAX ERROR")
         
-        # SAVE command
-        elif command.startswith('SAVE'):
-            self.handle_save(original_command[4:].strip())
+        var_part, rest = for_part.split('=', 1)
+        var_name = var_part.strip()
         
-        # COLOR command (C64-style)
-        elif command.startswith('COLOR'):
-            self.handle_color(original_command[5:].strip())
+        # Parse TO and STEP
+        to_index = rest.upper().find(' TO ')
+        if to_index == -1:
+            return Instr(OP_ERROR, "SYNTAX ERROR")
         
-        # SCREEN command (set background color)
-        elif command.startswith('SCREEN'):
-            try:
-                bg_color = int(self.evaluate_expression(original_command[6:].strip()))
-                self.variables['BG'] = bg_color
-                self.set_color(self.variables.get('CO', 1), bg_color)
-            except:
-                self.print_error("SYNTAX ERROR")
+        start_expr = rest[:to_index].strip()
+        step_part = rest[to_index + 4:]
         
+        step_index = step_part.upper().find(' STEP ')
+        if step_index != -1:
+            end_expr = step_part[:step_index].strip()
+            step_expr = step_part[step_index + 6:].strip()
         else:
-            self.print_error(f"SYNTAX ERROR IN {self.current_line}")
-    
-    def handle_print(self, args: str):
-        """Handle PRINT command"""
-        if not args:
-            self.color_print("\n", C64Colors.WHITE, C64Colors.BG_BLUE)
-            return
-        
-        # Check if the PRINT statement ends with a semicolon
-        ends_with_semicolon = args.strip().endswith(';')
-        
-        # Handle multiple expressions separated by semicolons or commas
-        parts = []
-        current_part = ""
-        in_string = False
-        paren_count = 0
-        
-        for char in args:
-            if char == '"':
-                in_string = not in_string
-                current_part += char
-            elif char == '(':
-                paren_count += 1
-                current_part += char
-            elif char == ')':
-                paren_count -= 1
-                current_part += char
-            elif char in [';', ','] and not in_string and paren_count == 0:
-                parts.append(current_part.strip())
-                parts.append(char)
-                current_part = ""
-            else:
-                current_part += char
+            end_expr = step_part.strip()
+            step_expr = None
         
-        if current_part:
-            parts.append(current_part.strip())
+        return Instr(OP_FOR, (self.intern(var_name), start_expr, end_expr, step_expr))
+    
+    def compile_next(self, var_name: str) -> Instr:
+        """Compile NEXT, resolving its loop variable to a slot"""
+        return Instr(OP_NEXT, self.intern(var_name) if var_name else None)
+    
+    def execute_command(self, command: str):
+        """Compile and execute a BASIC command"""
+        instr = self.compile_line(command)
+        self._dispatch[instr.op](instr)
+        self._flush()
+    
+    def _exec_print(self, instr: Instr):
+        """Execute PRINT"""
+        parts, ends_with_semicolon = instr.args
         
         # Process parts
-        output = ""
-        for part in parts:
-            if part == ';':
-                # No separator
-                pass
-            elif part == ',':
+        output = []
+        col = 0
+        for kind, value in parts:
+            if kind == 'expr':
+                try:
+                    text = str(self._eval_ops(value))
+                except:
+                    text = "0"
+                output.append(text)
+                col += len(text)
+            elif value == ',':
                 # Tab separator
-                output += " " * (16 - (len(output) % 16))
-            else:
-                result = self.evaluate_expression(part)
-                output += str(result)
+                pad = 16 - (col % 16)
+                output.append(" " * pad)
+                col += pad
         
         # Add newline unless the statement ends with a semicolon
         if not ends_with_semicolon:
-            output += "\n"
+            output.append("\n")
         
-        self.color_print(output, C64Colors.WHITE, C64Colors.BG_BLUE)
+        self.print_text("".join(output))
     
-    def handle_input(self, args: str):
-        """Handle INPUT command"""
-        prompt = ""
-        if args.startswith('"'):
-            end_quote = args.find('"', 1)
-            if end_quote != -1:
-                prompt = args[1:end_quote]
-                args = args[end_quote + 1:].strip()
+    def _exec_input(self, instr: Instr):
+        """Execute INPUT"""
+        prompt, var_names = instr.args
         
         if prompt:
-            print(prompt, end="")
+            self._emit(prompt)
         else:
-            print("? ", end="")
+            self._emit("? ")
+        self._flush()
         
         try:
             user_input = input()
             
-            # Parse variable names
-            var_names = [name.strip() for name in args.split(',')]
-            
             if len(var_names) == 1:
                 # Single variable
                 var_name = var_names[0]
@@ -606,114 +1041,270 @@ class C64Basic:
         except:
             self.print_error("REDO FROM START")
     
-    def handle_assignment(self, command: str):
-        """Handle variable assignment (LET command)"""
-        if command.startswith('LET '):
-            command = command[4:]
-        
-        if '=' in command:
-            var_part, expr_part = command.split('=', 1)
-            var_name = var_part.strip()
-            expr = expr_part.strip()
-            
-            result = self.evaluate_expression(expr)
-            self.variables[var_name] = result
+    def _exec_let(self, instr: Instr):
+        """Execute variable assignment"""
+        slot, expr = instr.args
+        self._slots[slot] = self.evaluate_expression(expr)
     
-    def handle_if_then(self, command: str):
-        """Handle IF-THEN command"""
-        # Extract condition and action
-        if_part = command[2:].strip()
-        
-        # Find THEN
-        then_index = if_part.find('THEN')
-        if then_index == -1:
-            self.print_error("SYNTAX ERROR")
-            return
-        
-        condition = if_part[:then_index].strip()
-        action = if_part[then_index + 4:].strip()
+    def _exec_if(self, instr: Instr):
+        """Execute IF-THEN"""
+        condition, action = instr.args
         
         # Evaluate condition
         try:
-            # Replace operators with Python equivalents
-            condition = condition.replace('=', '==')
-            condition = condition.replace('<>', '!=')
-            
-            # Evaluate variables in condition
-            for var_name, var_value in self.variables.items():
-                if isinstance(var_value, str):
-                    condition = condition.replace(var_name, f'"{var_value}"')
-                else:
-                    condition = condition.replace(var_name, str(var_value))
-            
-            if eval(condition):
-                self.execute_command(action)
+            result = self._eval_ops(condition)
         except:
             self.print_error("SYNTAX ERROR")
-    
-    def handle_for(self, command: str):
-        """Handle FOR command"""
-        # FOR I=1 TO 10 STEP 1
-        for_part = command[3:].strip()
-        
-        # Parse variable assignment
-        if '=' not in for_part:
-            self.print_error("SYNTAX ERROR")
             return
         
-        var_part, rest = for_part.split('=', 1)
-        var_name = var_part.strip()
+        if result:
+            self._dispatch[action.op](action)
+    
+    def _exec_for(self, instr: Instr):
+        """Execute FOR"""
+        slot, start_expr, end_expr, step_expr = instr.args
+        
+        start_value = self.evaluate_expression(start_expr)
+        end_value = self.evaluate_expression(end_expr)
+        step = self.evaluate_expression(step_expr) if step_expr is not None else 1
+        self._start_for(slot, start_value, end_value, step)
+    
+    def _start_for(self, slot: int, start_value, end_value, step):
+        """Enter a FOR loop handled by the generic NEXT path"""
+        # Store FOR loop info
+        self._for_frames[slot] = ForFrame(start_value, end_value, step, self.program_counter)
         
-        # Parse TO and STEP
-        if ' TO ' not in rest:
-            self.print_error("SYNTAX ERROR")
+        # Set initial value
+        self._slots[slot] = start_value
+    
+    def _exec_for_range(self, instr: Instr):
+        """Execute a FOR loop with a straight-line body as a native range() loop"""
+        slot, start_expr, end_expr, step_expr = instr.args
+        
+        start_value = self.evaluate_expression(start_expr)
+        end_value = self.evaluate_expression(end_expr)
+        step = self.evaluate_expression(step_expr) if step_expr is not None else 1
+        
+        # Only integer start/step can be handed to range(); anything else
+        # falls back to the generic loop through the (still linked) NEXT
+        if not (type(start_value) is int and type(step) is int and step != 0 and
+                (type(end_value) is int or (type(end_value) is float and math.isfinite(end_value)))):
+            self._start_for(slot, start_value, end_value, step)
             return
         
-        to_part, step_part = rest.split(' TO ', 1)
-        start_value = self.evaluate_expression(to_part.strip())
-        
-        if ' STEP ' in step_part:
-            step_expr, step_value = step_part.split(' STEP ', 1)
-            end_value = self.evaluate_expression(step_expr.strip())
-            step = self.evaluate_expression(step_value.strip())
+        if step > 0:
+            stop = math.floor(end_value) + 1
         else:
-            end_value = self.evaluate_expression(step_part.strip())
-            step = 1
+            stop = math.ceil(end_value) - 1
         
-        # Store FOR loop info
-        self.for_loops[var_name] = {
-            'start': start_value,
-            'end': end_value,
-            'step': step,
-            'current': start_value,
-            'return_line': self.program_counter
-        }
+        # BASIC runs the body at least once, even when start is already past end
+        values = range(start_value, stop, step) or range(start_value, start_value + 1)
         
-        # Set initial value
-        self.variables[var_name] = start_value
+        if len(values) >= _JIT_MIN_TRIPS and self._run_jit(instr, values):
+            self.program_counter = instr.target
+            return
+        
+        slots = self._slots
+        dispatch = self._dispatch
+        body = instr.body
+        for value in values:
+            slots[slot] = value
+            for body_instr in body:
+                dispatch[body_instr.op](body_instr)
+        
+        # Leave the variable one step past the last value, as NEXT does
+        slots[slot] = value + step
+        self._for_frames[slot] = None
+        self.program_counter = instr.target
     
-    def handle_next(self, var_name: str):
-        """Handle NEXT command"""
-        if var_name not in self.for_loops:
+    def _jit_loop(self, instr: Instr) -> Optional[tuple]:
+        """Compile a FOR_RANGE body of numeric assignments with numba, once per link"""
+        if instr in self._jit_loops:
+            return self._jit_loops[instr]
+        self._jit_loops[instr] = None
+        if not _import_numba():
+            return None
+        
+        slot = instr.args[0]
+        used = {slot}
+        assigned = [slot]
+        source = ["def loop(slots, start, stop, step):",
+                  "    for value in range(start, stop, step):",
+                  f"        slots[{slot}] = value"]
+        for body_instr in instr.body:
+            if body_instr.op == OP_REM:
+                continue
+            if body_instr.op != OP_LET:
+                return None
+            target, expr = body_instr.args
+            ops = self.compile_expr(expr.strip())
+            statements = _jit_expr_source(ops, f"slots[{target}]")
+            if statements is None:
+                return None
+            used.add(target)
+            used.update(op[1] for op in ops if op[0] == 'var')
+            if target not in assigned:
+                assigned.append(target)
+            source.extend("        " + statement for statement in statements)
+        source.append("    return True")
+        
+        namespace = {}
+        exec("\n".join(source), namespace)
+        self._jit_loops[instr] = (numba.njit(namespace['loop']), sorted(used), assigned)
+        return self._jit_loops[instr]
+    
+    def _run_jit(self, instr: Instr, values: range) -> bool:
+        """Run a FOR_RANGE loop natively; False leaves it to the interpreter untouched"""
+        loop = self._jit_loop(instr)
+        if loop is None:
+            return False
+        func, used, assigned = loop
+        
+        slots = self._slots
+        if not all(_jit_exact(slots[slot]) for slot in used):
+            return False
+        if not (_jit_exact(values.start) and _jit_exact(values.stop)):
+            return False
+        
+        # The compiled loop works on a copy, so a failed run has no side effects
+        array = numpy.zeros(len(slots))
+        for slot in used:
+            array[slot] = slots[slot]
+        try:
+            finished = func(array, values.start, values.stop, values.step)
+        except ZeroDivisionError:
+            return False
+        except Exception:
+            # numba could not compile the body; stop trying for this link
+            self._jit_loops[instr] = None
+            return False
+        if not finished:
+            return False
+        
+        results = [_number(float(array[slot])) for slot in assigned]
+        if not all(_jit_exact(value) for value in results):
+            return False
+        for slot, value in zip(assigned, results):
+            slots[slot] = value
+        
+        # Leave the variable one step past the last value, as NEXT does
+        slots[assigned[0]] = values[-1] + values.step
+        self._for_frames[assigned[0]] = None
+        return True
+    
+    def _exec_next(self, instr: Instr):
+        """Execute NEXT"""
+        slot = instr.args
+        frame = self._for_frames[slot] if slot is not None else None
+        if frame is None:
             self.print_error(f"NEXT WITHOUT FOR ERROR")
             return
         
-        loop = self.for_loops[var_name]
-        loop['current'] += loop['step']
-        self.variables[var_name] = loop['current']
+        frame.current = _number(frame.current + frame.step)
+        self._slots[slot] = frame.current
         
-        # Check if loop should continue
-        if loop['step'] > 0:
-            if loop['current'] <= loop['end']:
-                self.program_counter = loop['return_line']
+        # Loop again, or remove the loop once it is finished
+        if frame.step > 0:
+            finished = frame.current > frame.end
         else:
-            if loop['current'] >= loop['end']:
-                self.program_counter = loop['return_line']
+            finished = frame.current < frame.end
         
-        # Remove loop if finished
-        if (loop['step'] > 0 and loop['current'] > loop['end']) or \
-           (loop['step'] < 0 and loop['current'] < loop['end']):
-            del self.for_loops[var_name]
+        if finished:
+            self._for_frames[slot] = None
+        elif instr.target is not None:
+            self.program_counter = instr.target
+        else:
+            self.program_counter = frame.return_pc
+    
+    def _jump_target(self, instr: Instr) -> int:
+        """Program counter a GOTO/GOSUB transfers to"""
+        if instr.target is not None:
+            return instr.target
+        
+        # Computed target (or an unlinked immediate-mode statement)
+        line_num = int(self.evaluate_expression(instr.args))
+        return self._line_index.get(line_num, len(self._code))
+    
+    def _exec_goto(self, instr: Instr):
+        """Execute GOTO"""
+        self.program_counter = self._jump_target(instr)
+    
+    def _exec_gosub(self, instr: Instr):
+        """Execute GOSUB"""
+        target = self._jump_target(instr)
+        self.gosub_stack.append(self.program_counter)
+        self.program_counter = target
+    
+    def _exec_return(self, instr: Instr):
+        """Execute RETURN"""
+        if self.gosub_stack:
+            self.program_counter = self.gosub_stack.pop()
+    
+    def _exec_rem(self, instr: Instr):
+        """Execute REM (no-op)"""
+        pass
+    
+    def _exec_cls(self, instr: Instr):
+        """Execute CLS"""
+        self.clear_screen()
+    
+    def _exec_list(self, instr: Instr):
+        """Execute LIST"""
+        self.list_program()
+    
+    def _exec_run(self, instr: Instr):
+        """Execute RUN"""
+        self.run_program()
+    
+    def _exec_new(self, instr: Instr):
+        """Execute NEW"""
+        self.lines.clear()
+        self.lines_changed()
+        self.reset_variables()
+        self.program_counter = 0
+        self.print_ready()
+    
+    def _exec_end(self, instr: Instr):
+        """Execute END"""
+        self.running = False
+    
+    def _exec_wait(self, instr: Instr):
+        """Execute WAIT (simple delay)"""
+        try:
+            delay = float(self.evaluate_expression(instr.args))
+            self._flush()
+            time.sleep(delay)
+        except:
+            pass
+    
+    def _exec_simulated(self, instr: Instr):
+        """Execute a simulated hardware command (POKE, PEEK, SYS)"""
+        self.color_print(instr.args, C64Colors.RED, C64Colors.BG_BLUE, True)
+    
+    def _exec_load(self, instr: Instr):
+        """Execute LOAD"""
+        self.handle_load(instr.args)
+    
+    def _exec_save(self, instr: Instr):
+        """Execute SAVE"""
+        self.handle_save(instr.args)
+    
+    def _exec_color(self, instr: Instr):
+        """Execute COLOR"""
+        self.handle_color(instr.args)
+    
+    def _exec_screen(self, instr: Instr):
+        """Execute SCREEN"""
+        try:
+            bg_color = int(self.evaluate_expression(instr.args))
+            self.variables['BG'] = bg_color
+            self.set_color(self.variables.get('CO', 1), bg_color)
+        except:
+            self.print_error("SYNTAX ERROR")
+    
+    def _exec_error(self, instr: Instr):
+        """Report a statement that failed to compile"""
+        self.print_error(instr.args or f"SYNTAX ERROR IN {self.current_line_number()}")
     
     def list_program(self):
         """List the current program"""
@@ -721,8 +1312,98 @@ class C64Basic:
             self.print_ready()
             return
         
-        for line_num in sorted(self.lines.keys()):
-            self.color_print(f"{line_num} {self.lines[line_num]}\n", C64Colors.WHITE, C64Colors.BG_BLUE)
+        for line_num in self.sorted_lines():
+            self.color_print(f"{line_num} {self.lines[line_num].source}\n", C64Colors.WHITE, C64Colors.BG_BLUE)
+    
+    def store_line(self, line_num: int, command: str):
+        """Compile a program line and store it with its source text"""
+        instr = self.compile_line(command)
+        instr.source = command
+        self.lines[line_num] = instr
+        self.lines_changed()
+    
+    def lines_changed(self):
+        """Invalidate the sorted line cache and the linked program"""
+        self._lines_dirty = True
+        self._linked = False
+        # A running program's code is gone (NEW, LOAD), so it must not go on
+        self.running = False
+    
+    def sorted_lines(self) -> List[int]:
+        """Program line numbers in order, cached until the program changes"""
+        if self._lines_dirty:
+            self._sorted_lines = sorted(self.lines.keys())
+            self._lines_dirty = False
+        return self._sorted_lines
+    
+    def link_program(self):
+        """Lay the program out in line order and resolve constant jump targets"""
+        self._order = self.sorted_lines()
+        self._code = [self.lines[line_num] for line_num in self._order]
+        self._line_index = {line_num: pc for pc, line_num in enumerate(self._order)}
+        self._jit_loops.clear()
+        
+        for pc, instr in enumerate(self._code):
+            if instr.op in (OP_FOR, OP_FOR_RANGE):
+                self._link_for(pc, instr)
+            else:
+                self._link_instr(instr)
+        
+        self._link_next()
+    
+    def _link_next(self):
+        """Point each NEXT straight back at the body of its FOR"""
+        # Loop body start of every variable that has a single, unconditional FOR;
+        # a variable with several FORs (or one inside IF) keeps the runtime return_pc
+        body_pc = {}
+        shared = set()
+        for pc, instr in enumerate(self._code):
+            if instr.op == OP_IF and instr.args[1].op == OP_FOR:
+                shared.add(instr.args[1].args[0])
+            elif instr.op in (OP_FOR, OP_FOR_RANGE):
+                slot = instr.args[0]
+                if slot in body_pc:
+                    shared.add(slot)
+                body_pc[slot] = pc + 1
+        
+        for instr in self._code:
+            if instr.op == OP_NEXT:
+                slot = instr.args
+                instr.target = body_pc[slot] if slot in body_pc and slot not in shared else None
+    
+    def _link_for(self, pc: int, instr: Instr):
+        """Switch a FOR to the range fast path when its body is straight-line code"""
+        instr.op = OP_FOR
+        instr.body = None
+        slot = instr.args[0]
+        
+        for next_pc in range(pc + 1, len(self._code)):
+            candidate = self._code[next_pc]
+            if candidate.op == OP_NEXT:
+                if candidate.args == slot:
+                    instr.op = OP_FOR_RANGE
+                    instr.body = self._code[pc + 1:next_pc]
+                    instr.target = next_pc + 1
+                return
+            if not candidate.is_straight_line():
+                return
+    
+    def _link_instr(self, instr: Instr):
+        """Resolve the jump target of a single (possibly nested) instruction"""
+        if instr.op == OP_IF:
+            self._link_instr(instr.args[1])
+        elif instr.op in (OP_GOTO, OP_GOSUB):
+            if instr.args.isdigit():
+                # Missing lines resolve past the end, which stops the program
+                instr.target = self._line_index.get(int(instr.args), len(self._code))
+            else:
+                instr.target = None
+    
+    def current_line_number(self) -> int:
+        """BASIC line number of the statement being executed, or 0 outside a program"""
+        if self.running and 0 < self.program_counter <= len(self._order):
+            return self._order[self.program_counter - 1]
+        return 0
     
     def run_program(self):
         """Run the current program"""
@@ -730,26 +1411,24 @@ class C64Basic:
             self.print_ready()
             return
         
+        if not self._linked:
+            self.link_program()
+            self._linked = True
+        code = self._code
+        end = len(code)
+        dispatch = self._dispatch
+        
+        self.gosub_stack.clear()
+        self._for_frames = [None] * len(self._slots)
         self.running = True
-        self.program_counter = min(self.lines.keys())
+        self.program_counter = 0
         
-        while self.running and self.program_counter in self.lines:
-            line_num = self.program_counter
-            command = self.lines[line_num]
-            
-            # Find next line
-            line_numbers = sorted(self.lines.keys())
-            current_index = line_numbers.index(line_num)
-            if current_index + 1 < len(line_numbers):
-                self.program_counter = line_numbers[current_index + 1]
-            else:
-                self.program_counter = None
-            
-            self.execute_command(command)
-            
-            if self.program_counter is None:
-                break
+        while self.running and self.program_counter < end:
+            instr = code[self.program_counter]
+            self.program_counter += 1
+            dispatch[instr.op](instr)
         
+        self.running = False
         self.print_ready()
     
     def add_line(self, line: str):
@@ -758,11 +1437,12 @@ class C64Basic:
         
         if line_num is not None:
             if command:
-                self.lines[line_num] = command
+                self.store_line(line_num, command)
             else:
                 # Empty line - delete it
                 if line_num in self.lines:
                     del self.lines[line_num]
+                    self.lines_changed()
         else:
             # Immediate mode
             self.execute_command(command)
@@ -773,6 +1453,7 @@ class C64Basic:
         
         while True:
             try:
+                self._flush()
                 line = input()
                 if line.upper() == 'BYE':
                     self.color_print("GOODBYE!\n", C64Colors.WHITE, C64Colors.BG_BLUE, True)
@@ -781,12 +1462,16 @@ class C64Basic:
                 self.add_line(line)
                 
             except KeyboardInterrupt:
-                self.print_break(self.program_counter or 0)
+                self.print_break(self.current_line_number())
+                self.running = False
                 self.print_ready()
             except EOFError:
                 break
             except Exception as e:
+                self.running = False
                 self.print_error(f"SYNTAX ERROR")
+        
+        self._flush()
 
 def main():
     """Main function to run the C64 BASIC interpreter"""
@@ -3,128 +3,416 @@
 Test script for C64 BASIC interpreter
 """
 
+import contextlib
+import io
+import os
+import re
 import subprocess
 import sys
 import tempfile
-import os
 
-def test_basic_commands():
-    """Test basic commands"""
-    print("Testing C64 BASIC interpreter...")
-    
-    # Test commands
-    test_commands = [
-        'PRINT "HELLO, WORLD!"',
-        'A = 5',
-        'PRINT A',
-        'B = 10',
-        'PRINT "A + B = "; A + B',
-        'C$ = "HELLO"',
-        'D$ = "WORLD"',
-        'PRINT C$ + " " + D$',
-        'PRINT "LENGTH: "; LEN(C$)',
-        'PRINT "RANDOM: "; INT(RND(1) * 100)',
-        'PRINT "SQUARE ROOT OF 16: "; SQR(16)',
-        'PRINT "ABS(-5): "; ABS(-5)',
-        'BYE'
-    ]
-    
-    # Create temporary input file
-    with tempfile.NamedTemporaryFile(mode='w', delete=False) as f:
-        for cmd in test_commands:
-            f.write(cmd + '\n')
-        input_file = f.name
-    
+import pytest
+
+# Test commands
+TEST_COMMANDS = (
+    'PRINT "HELLO, WORLD!"',
+    'A = 5',
+    'PRINT A',
+    'B = 10',
+    'PRINT "A + B = "; A + B',
+    'C$ = "HELLO"',
+    'D$ = "WORLD"',
+    'PRINT C$ + " " + D$',
+    'PRINT "LENGTH: "; LEN(C$)',
+    'PRINT "RANDOM: "; INT(RND(1) * 100)',
+    'PRINT "SQUARE ROOT OF 16: "; SQR(16)',
+    'PRINT "ABS(-5): "; ABS(-5)',
+    'PRINT "POWER: "; 2^3^2',
+    'PRINT "EXPONENTS: "; 1E3; " "; 2.5E-1; " "; 1.5E+2',
+    'F = 5.0',
+    'PRINT "WHOLE FLOAT: "; F',
+    'BYE'
+)
+
+# Sample program
+PROGRAM_LINES = (
+    '10 PRINT "PROGRAM MODE TEST"',
+    '20 A = 10',
+    '30 B = 20',
+    '40 PRINT "A = "; A',
+    '50 PRINT "B = "; B',
+    '60 PRINT "SUM = "; A + B',
+    '70 FOR I = 1 TO 3',
+    '80 PRINT I',
+    '90 NEXT I',
+    '100 END',
+    'RUN',
+    'BYE'
+)
+
+# Regular expressions for the lines each batch must print, in order
+EXPECTED_COMMAND_OUTPUT = (
+    r'HELLO, WORLD!',
+    r'5',
+    r'A \+ B = 15',
+    r'HELLO WORLD',
+    r'LENGTH: 5',
+    r'RANDOM: \d+',
+    r'SQUARE ROOT OF 16: 4\.0',
+    r'ABS\(-5\): 5',
+    r'POWER: 64',
+    r'EXPONENTS: 1000 0\.25 150',
+    r'WHOLE FLOAT: 5',
+)
+
+EXPECTED_PROGRAM_OUTPUT = (
+    r'PROGRAM MODE TEST',
+    r'A = 10',
+    r'B = 20',
+    r'SUM = 30',
+    r'1',
+    r'2',
+    r'3',
+    r'READY\.',
+)
+
+# Loop programs covering the range() fast path, linked jump targets and NEXT back edges,
+# each with the lines it must print
+LOOP_PROGRAMS = {
+    'nested_for': (
+        (
+            '10 FOR I = 1 TO 3',
+            '20 FOR J = 1 TO 2',
+            '30 PRINT I * 10 + J',
+            '40 NEXT J',
+            '50 NEXT I',
+            '60 PRINT "DONE "; I; " "; J',
+            'RUN',
+            'BYE'
+        ),
+        (r'11', r'12', r'21', r'22', r'31', r'32', r'DONE 4 3'),
+    ),
+    'goto_out_and_back': (
+        (
+            '10 FOR I = 1 TO 3',
+            '20 GOTO 100',
+            '30 PRINT "BACK "; I',
+            '40 NEXT I',
+            '50 END',
+            '100 PRINT "OUT "; I',
+            '110 GOTO 30',
+            'RUN',
+            'BYE'
+        ),
+        (r'OUT 1', r'BACK 1', r'OUT 2', r'BACK 2', r'OUT 3', r'BACK 3'),
+    ),
+    'fractional_step': (
+        (
+            '10 FOR X = 0 TO 1 STEP 0.25',
+            '20 PRINT X',
+            '30 NEXT X',
+            'RUN',
+            'BYE'
+        ),
+        (r'0', r'0\.25', r'0\.5', r'0\.75', r'1'),
+    ),
+    'start_past_end': (
+        (
+            '10 FOR K = 5 TO 1',
+            '20 PRINT "ONCE "; K',
+            '30 NEXT K',
+            '40 PRINT "AFTER "; K',
+            'RUN',
+            'BYE'
+        ),
+        (r'ONCE 5', r'AFTER 6', r'READY\.'),
+    ),
+    'gosub_in_loop': (
+        (
+            '10 FOR I = 1 TO 3',
+            '20 GOSUB 100',
+            '30 NEXT I',
+            '40 END',
+            '100 PRINT "SUB "; I',
+            '110 RETURN',
+            'RUN',
+            'BYE'
+        ),
+        (r'SUB 1', r'SUB 2', r'SUB 3', r'READY\.'),
+    ),
+    'edit_and_rerun': (
+        (
+            '10 FOR I = 1 TO 2',
+            '20 PRINT "A "; I',
+            '30 NEXT I',
+            'RUN',
+            '20 PRINT "B "; I',
+            'RUN',
+            'BYE'
+        ),
+        (r'A 1', r'A 2', r'READY\.', r'B 1', r'B 2', r'READY\.'),
+    ),
+}
+
+# Source lines in the order LIST prints them, entered out of order below
+LISTED_SOURCE = (
+    '5 REM   SPACED   OUT',
+    '10 PRINT "Hello, World"; A$',
+    '20 FOR I = 1 TO 3 STEP 2',
+    '30 IF I >= 2 THEN PRINT "BIG"',
+    '40 NEXT I',
+)
+# Where the round-trip batch SAVEs its program; the session removes it afterwards
+SAVED_PROGRAM = os.path.join(tempfile.gettempdir(), f"c64_basic_test_{os.getpid()}.bas")
+
+# Programs covering single statements, each with every line its batch must print
+# (the first READY. comes from the NEW that ends the previous batch)
+STATEMENT_PROGRAMS = {
+    'if_comparisons': (
+        (
+            '10 A = 5',
+            '20 IF A >= 5 THEN PRINT "GE"',
+            '30 IF A <= 4 THEN PRINT "LE"',
+            '40 IF A <> 5 THEN PRINT "NE"',
+            '50 IF A = 5 THEN PRINT "EQ"',
+            '60 PRINT 1 = 1; " "; 1 < 0; " "; 2 <> 3',
+            '70 AB = 10',
+            '80 IF AB > A THEN PRINT "AB BIGGER"',
+            '90 IF A$ = "" THEN GOTO 110',
+            '100 PRINT "NOT SKIPPED"',
+            '110 PRINT "END"',
+            'RUN',
+            'BYE'
+        ),
+        (r'READY\.', r'GE', r'EQ', r'-1 0 -1', r'AB BIGGER', r'END', r'READY\.'),
+    ),
+    'list_save_load': (
+        (
+            *LISTED_SOURCE[1:],
+            LISTED_SOURCE[0],
+            'LIST',
+            f'SAVE "{SAVED_PROGRAM}"',
+            'NEW',
+            f'LOAD "{SAVED_PROGRAM}"',
+            'LIST',
+            'BYE'
+        ),
+        (
+            r'READY\.',
+            *map(re.escape, LISTED_SOURCE),
+            re.escape(f'SAVING "{SAVED_PROGRAM}"'), r'READY\.',
+            r'READY\.',
+            re.escape(f'LOADING "{SAVED_PROGRAM}"'), r'READY\.',
+            *map(re.escape, LISTED_SOURCE),
+        ),
+    ),
+    'new_in_program': (
+        (
+            '10 PRINT "BEFORE"',
+            '20 NEW',
+            '30 PRINT "AFTER"',
+            'RUN',
+            'LIST',
+            'PRINT "NEXT"',
+            'BYE'
+        ),
+        (r'READY\.', r'BEFORE', r'READY\.', r'READY\.', r'READY\.', r'NEXT'),
+    ),
+    'load_in_program': (
+        (
+            '10 PRINT "BEFORE"',
+            '20 LOAD "testfile"',
+            '30 PRINT "AFTER"',
+            'RUN',
+            'LIST',
+            'BYE'
+        ),
+        (
+            r'READY\.', r'BEFORE', r'LOADING "testfile\.bas"', r'READY\.', r'READY\.',
+            r'10 PRINT "HELLO FROM LOWERCASE FILE"', r'20 PRINT "THIS IS A TEST"', r'30 END',
+        ),
+    ),
+}
+
+# Loops long enough for the numba path: one whose intermediates leave float64's
+# exact integer range (the compiled loop must give up), and one it can run;
+# each with the lines it must print
+JIT_PROGRAMS = {
+    'inexact_intermediates': (
+        (
+            '10 S = 0',
+            '20 FOR I = 1 TO 60000',
+            '30 T = (I*I*I*I*I + 1) - I*I*I*I*I',
+            '40 S = S + T',
+            '50 NEXT I',
+            '60 PRINT S; " "; T',
+        ),
+        (r'60000 1', r'READY\.'),
+    ),
+    'fractional_sums': (
+        (
+            '10 FOR I = 1 TO 60000',
+            '20 S = S + I * 0.5',
+            '30 T = T - I / 4',
+            '40 NEXT I',
+            '50 PRINT S; " "; T; " "; I',
+        ),
+        (r'900015000 -450007500 60001', r'READY\.'),
+    ),
+}
+
+# Every batch runs in one interpreter process; this line separates their output
+BATCH_SENTINEL = "*** END OF TEST BATCH ***"
+BATCHES = {
+    'commands': TEST_COMMANDS,
+    'program': PROGRAM_LINES,
+    **{name: lines for name, (lines, _) in LOOP_PROGRAMS.items()},
+    **{name: lines for name, (lines, _) in STATEMENT_PROGRAMS.items()},
+}
+
+def build_session(batches):
+    """Join batches into one session: each without its BYE, then the sentinel and NEW to reset state"""
+    session = []
+    for batch in batches.values():
+        session.extend(line for line in batch if line != 'BYE')
+        session.append(f'PRINT "{BATCH_SENTINEL}"')
+        session.append('NEW')
+    session.append('BYE')
+    return "\n".join(session) + "\n"
+
+SESSION_INPUT = build_session(BATCHES)
+
+# Larger kernel pipe buffers (Python 3.10+) keep a long RUN from blocking on output
+PIPE_OPTIONS = {'pipesize': 1024 * 1024} if sys.version_info >= (3, 10) else {}
+
+# Seconds to wait for the interpreter before treating it as hung
+INTERPRETER_TIMEOUT = 30
+
+# Output of each batch, keyed by its name in BATCHES
+_batch_output = {}
+# Exit status of the interpreter process
+_session_returncode = None
+# Why the session failed (e.g. it timed out), so later tests fail without rerunning it
+_session_error = None
+
+def batch_output(name):
+    """Return the interpreter's output for the batch BATCHES[name], running the session on first use"""
+    if _session_error is not None:
+        raise _session_error
+    if not _batch_output:
+        _run_session()
+    return _batch_output[name]
+
+def _run_session():
+    """Run every batch through one interpreter process and store each batch's output"""
+    global _session_error, _session_returncode
+    # Pipe the test input straight to the interpreter; only stdout is captured,
+    # stderr goes directly to the terminal
+    process = subprocess.Popen(
+        [sys.executable, 'c64_basic.py'],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        text=True,
+        bufsize=65536,
+        **PIPE_OPTIONS
+    )
     try:
-        # Run the interpreter with test input
-        result = subprocess.run(
-            [sys.executable, 'c64_basic.py'],
-            input=open(input_file, 'r').read(),
-            capture_output=True,
-            text=True
-        )
-        
-        print("Output:")
-        print(result.stdout)
-        
-        if result.stderr:
-            print("Errors:")
-            print(result.stderr)
-            
-        return True
-        
-    except Exception as e:
-        print(f"Error running test: {e}")
-        return False
+        stdout, _ = process.communicate(SESSION_INPUT, timeout=INTERPRETER_TIMEOUT)
+    except subprocess.TimeoutExpired as e:
+        process.kill()
+        process.communicate()
+        _session_error = e
+        raise
     finally:
-        os.unlink(input_file)
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(SAVED_PROGRAM)
+    
+    outputs = stdout.split(BATCH_SENTINEL + '\n')
+    for index, name in enumerate(BATCHES):
+        _batch_output[name] = outputs[index] if index < len(outputs) else ""
+    _session_returncode = process.returncode
+
+def report_batch(title, output):
+    """Print a batch's output under a title"""
+    print(f"{title}\n{output}")
+
+def check_batch(output, expected):
+    """Assert the interpreter exited cleanly and printed lines matching the expected patterns, in order"""
+    assert _session_returncode == 0, f"interpreter exited with status {_session_returncode}"
+    check_lines(output, expected)
+
+def check_batch_exactly(output, expected):
+    """Assert the interpreter exited cleanly and printed only lines matching the expected patterns, one each"""
+    assert _session_returncode == 0, f"interpreter exited with status {_session_returncode}"
+    lines = output.splitlines()
+    assert len(lines) == len(expected), f"expected {len(expected)} lines, got {lines!r}"
+    for pattern, line in zip(expected, lines):
+        assert re.fullmatch(pattern, line), f"line {line!r} does not match {pattern!r}"
+
+def check_lines(output, expected):
+    """Assert the output has lines matching the expected patterns, in order"""
+    lines = iter(output.splitlines())
+    for pattern in expected:
+        assert any(re.fullmatch(pattern, line) for line in lines), f"no line matching {pattern!r} in output"
+
+def test_basic_commands():
+    """Test basic commands"""
+    output = batch_output('commands')
+    report_batch("Testing C64 BASIC interpreter...\nOutput:", output)
+    check_batch(output, EXPECTED_COMMAND_OUTPUT)
 
 def test_program_mode():
     """Test program mode with sample program"""
-    print("\nTesting program mode...")
-    
-    # Sample program
-    program_lines = [
-        '10 PRINT "PROGRAM MODE TEST"',
-        '20 A = 10',
-        '30 B = 20',
-        '40 PRINT "A = "; A',
-        '50 PRINT "B = "; B',
-        '60 PRINT "SUM = "; A + B',
-        '70 FOR I = 1 TO 3',
-        '80 PRINT I',
-        '90 NEXT I',
-        '100 END',
-        'RUN',
-        'BYE'
-    ]
-    
-    # Create temporary input file
-    with tempfile.NamedTemporaryFile(mode='w', delete=False) as f:
-        for line in program_lines:
-            f.write(line + '\n')
-        input_file = f.name
+    output = batch_output('program')
+    report_batch("\nTesting program mode...\nProgram mode output:", output)
+    check_batch(output, EXPECTED_PROGRAM_OUTPUT)
+
+@pytest.mark.parametrize("name", LOOP_PROGRAMS)
+def test_loops(name):
+    """Test FOR loops combined with nesting, jumps, subroutines and program edits"""
+    output = batch_output(name)
+    report_batch(f"\nTesting loops: {name}...\nOutput:", output)
+    check_batch(output, LOOP_PROGRAMS[name][1])
+
+@pytest.mark.parametrize("name", STATEMENT_PROGRAMS)
+def test_statements(name):
+    """Test statements whose whole output is known: IF, LIST, SAVE and LOAD, and NEW and LOAD inside a program"""
+    output = batch_output(name)
+    report_batch(f"\nTesting statements: {name}...\nOutput:", output)
+    check_batch_exactly(output, STATEMENT_PROGRAMS[name][1])
+
+def run_program_in_process(c64_basic, lines):
+    """Run a program on a fresh interpreter in this process and return its output"""
+    interpreter = c64_basic.C64Basic()
+    for line in lines:
+        interpreter.add_line(line)
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        interpreter.execute_command('RUN')
+    return output.getvalue()
+
+@pytest.mark.parametrize("name", JIT_PROGRAMS)
+def test_jit_matches_interpreter(name, monkeypatch):
+    """Test that numba-compiled FOR loops print what the interpreter prints"""
+    pytest.importorskip("numba")
+    import c64_basic
     
-    try:
-        # Run the interpreter with test input
-        result = subprocess.run(
-            [sys.executable, 'c64_basic.py'],
-            input=open(input_file, 'r').read(),
-            capture_output=True,
-            text=True
-        )
-        
-        print("Program mode output:")
-        print(result.stdout)
-        
-        if result.stderr:
-            print("Errors:")
-            print(result.stderr)
-            
-        return True
-        
-    except Exception as e:
-        print(f"Error running program mode test: {e}")
-        return False
-    finally:
-        os.unlink(input_file)
+    # Compile these loops although they are shorter than the break-even point
+    monkeypatch.setattr(c64_basic, "_JIT_MIN_TRIPS", 1000)
+    lines, expected = JIT_PROGRAMS[name]
+    compiled = run_program_in_process(c64_basic, lines)
+    monkeypatch.setattr(c64_basic, "numba", False)
+    interpreted = run_program_in_process(c64_basic, lines)
+    assert compiled == interpreted
+    check_lines(compiled, expected)
 
 if __name__ == "__main__":
     print("C64 BASIC Interpreter Test Suite")
     print("=" * 40)
     
-    # Test basic commands
-    if test_basic_commands():
-        print("✓ Basic commands test passed")
-    else:
-        print("✗ Basic commands test failed")
-    
-    # Test program mode
-    if test_program_mode():
-        print("✓ Program mode test passed")
-    else:
-        print("✗ Program mode test failed")
+    # Run through pytest so parametrized tests and skips are reported like any other run
+    status = pytest.main([__file__, "-v", "-s"])
     
     print("\nTest complete!")
     print("\nTo run the interpreter manually:")
-    print("python3 c64_basic.py") 
\ No newline at end of file
+    print("python3 c64_basic.py")
+    sys.exit(status)